@@ -1,12 +1,20 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
-import time, re, os, json
-from datetime import datetime
-from jinja2 import Template
+# Selenium, BeautifulSoup and Jinja2 are imported where they are used, so the
+# history helpers can be imported (and tested) without a browser toolchain
+import time, re, os, sys, json, glob, socket, sqlite3
+from datetime import datetime, timedelta
+from urllib.parse import unquote, urlsplit, urlunsplit
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Characters folded together for product name search: Arabic ye/kaf to Persian,
+# ZWNJ to a plain space and Persian/Arabic-Indic digits to ASCII
+SEARCH_CHAR_MAP = {"ي": "ی", "ى": "ی", "ك": "ک", "\u200c": " "}
+SEARCH_CHAR_MAP.update({d: str(i) for i, d in enumerate("۰۱۲۳۴۵۶۷۸۹")})
+SEARCH_CHAR_MAP.update({d: str(i) for i, d in enumerate("٠١٢٣٤٥٦٧٨٩")})
+
+PRODUCT_ID_RE = re.compile(r"/p/([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})")
 
 # --- Helper functions ---
 def persian_to_english(num_str):
@@ -21,160 +29,471 @@ def extract_number(text):
         return int("".join(numbers))
     return None
 
+def product_id(link):
+    """Extract the canonical Torob product UUID from a product link"""
+    match = PRODUCT_ID_RE.search(link)
+    if match:
+        return match.group(1).lower()
+    return link
+
+def compact_link(link):
+    """Short canonical link for storage: the product page without slug or query string"""
+    pid = product_id(link)
+    if pid != link:
+        return f"https://torob.com/p/{pid}/"
+    parts = urlsplit(link)
+    return unquote(urlunsplit((parts.scheme, parts.netloc, parts.path, "", "")))
+
+def merge_price_entries(*price_lists):
+    """Merge several price lists into one, keeping the first entry seen for each date"""
+    merged = {}
+    for prices in price_lists:
+        for entry in prices:
+            merged.setdefault(entry["date"], entry)
+    return [merged[date] for date in sorted(merged)]
+
+def migrate_history(history):
+    """Re-key URL-keyed history entries by product ID, merging split histories"""
+    migrated = {}
+    # Longest series first so its prices win on conflicting dates, even for already migrated entries
+    for key, data in sorted(history.items(), key=lambda item: -len(item[1].get("prices", []))):
+        pid = product_id(key)
+        link = compact_link(data.get("link", key))
+        if pid not in migrated:
+            migrated[pid] = {
+                "name": data["name"],
+                "link": link,
+                "prices": data.get("prices", [])
+            }
+        else:
+            migrated[pid]["prices"] = merge_price_entries(migrated[pid]["prices"], data.get("prices", []))
+    return migrated
+
 def load_history():
     """Load price history from JSON file"""
-    if os.path.exists("price_history.json"):
-        with open("price_history.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    if not os.path.exists("price_history.json"):
+        return {}
+    with open("price_history.json", "r", encoding="utf-8") as f:
+        history = json.load(f)
+    # Only files still keyed by full URLs need re-keying
+    if any(product_id(key) != key for key in history):
+        history = migrate_history(history)
+    return history
 
 def save_history(history):
     """Save price history to JSON file"""
-    with open("price_history.json", "w", encoding="utf-8") as f:
+    # Write to a temporary file first so readers never see a half-written history
+    with open("price_history.json.tmp", "w", encoding="utf-8") as f:
         json.dump(history, f, ensure_ascii=False, indent=2)
+    os.replace("price_history.json.tmp", "price_history.json")
 
-def update_price_history(history, product_name, link, lowest_price, current_price):
+@contextmanager
+def history_lock():
+    """Hold an exclusive lock around a load-then-save of price_history.json"""
+    # An exclusive SQLite transaction on a side file works as a cross-process lock on every platform
+    conn = sqlite3.connect("price_history.lock", timeout=600, isolation_level=None)
+    conn.execute("BEGIN EXCLUSIVE")
+    try:
+        yield
+    finally:
+        conn.execute("ROLLBACK")
+        conn.close()
+
+def update_price_history(history, product_name, link, lowest_price, current_price, date=None,
+                         observed_at=None, worker=None):
     """Update price history for a product with both lowest and current price"""
-    today = datetime.now().strftime("%Y-%m-%d")
+    now = datetime.now()
+    today = date or now.strftime("%Y-%m-%d")
+    observed_at = observed_at or now.isoformat()
+    pid = product_id(link)
+    link = compact_link(link)
     
-    if link not in history:
-        history[link] = {
+    if pid not in history:
+        history[pid] = {
             "name": product_name,
+            "link": link,
             "prices": []
         }
+    else:
+        history[pid]["link"] = link
+    
+    new_entry = {
+        "date": today,
+        "lowest_price": lowest_price,
+        "current_price": current_price,
+        "observed_at": observed_at
+    }
+    if worker:
+        new_entry["worker"] = worker
     
     # Check if we already have an entry for today
-    existing_dates = [entry["date"] for entry in history[link]["prices"]]
+    existing_dates = [entry["date"] for entry in history[pid]["prices"]]
     
     if today not in existing_dates:
-        history[link]["prices"].append({
-            "date": today,
-            "lowest_price": lowest_price,
-            "current_price": current_price
-        })
+        history[pid]["prices"].append(new_entry)
+        # Observations merged from shards may arrive for an earlier date
+        if existing_dates and today < existing_dates[-1]:
+            history[pid]["prices"].sort(key=lambda e: e["date"])
     else:
-        # Update today's prices
-        for entry in history[link]["prices"]:
+        # Update today's prices, unless they come from a later observation already
+        # (shards of slow workers can be merged after newer ones)
+        for idx, entry in enumerate(history[pid]["prices"]):
             if entry["date"] == today:
-                entry["lowest_price"] = lowest_price
-                entry["current_price"] = current_price
+                if observation_order(new_entry) >= observation_order(entry):
+                    history[pid]["prices"][idx] = new_entry
                 break
     
     return history
 
-def smooth_scroll(driver, pause_time=2):
-    """Scroll smoothly and wait for content to load"""
-    last_height = driver.execute_script("return document.body.scrollHeight")
+def observation_order(entry):
+    """Sort key deciding which observation of a product wins for a day"""
+    # Entries saved before observed_at was recorded sort first and are always replaced
+    return (entry.get("observed_at", ""), entry.get("worker", ""))
+
+def aggregate_price_entries(entries, period):
+    """Collapse several price entries into one min/max/last entry for a week or month"""
+    last = entries[-1]
+    aggregate = {
+        "date": last["date"],
+        "period": period,
+        "lowest_price": last["lowest_price"],
+        "current_price": last["current_price"]
+    }
+    for field in ("lowest_price", "current_price"):
+        aggregate[field + "_min"] = min(e.get(field + "_min", e[field]) for e in entries)
+        aggregate[field + "_max"] = max(e.get(field + "_max", e[field]) for e in entries)
+    return aggregate
+
+def compact_history(history, daily_days=90, weekly_days=365, today=None):
+    """Keep daily prices for the last `daily_days`, weekly aggregates up to `weekly_days`, monthly beyond"""
+    today = today or datetime.now().date()
+    # Cutoffs fall on Mondays and weekly buckets never span two months, so every bucket
+    # lies wholly on one side of a cutoff and compacting again later gives the same
+    # result as compacting once on that later day
+    daily_start = today - timedelta(days=daily_days)
+    weekly_start = today - timedelta(days=weekly_days)
+    daily_cutoff = (daily_start - timedelta(days=daily_start.weekday())).strftime("%Y-%m-%d")
+    weekly_cutoff = (weekly_start - timedelta(days=weekly_start.weekday())).strftime("%Y-%m-%d")
+    
+    for data in history.values():
+        buckets = {}
+        recent = []
+        for entry in sorted(data["prices"], key=lambda e: e["date"]):
+            if entry["date"] >= daily_cutoff:
+                recent.append(entry)
+                continue
+            day = datetime.strptime(entry["date"], "%Y-%m-%d").date()
+            if entry["date"] >= weekly_cutoff:
+                year, week, _ = day.isocalendar()
+                key = ("week", f"{day.strftime('%Y-%m')}/{year}-W{week:02d}")
+            else:
+                key = ("month", day.strftime("%Y-%m"))
+            buckets.setdefault(key, []).append(entry)
+        
+        compacted = [aggregate_price_entries(entries, period) for (period, _), entries in buckets.items()]
+        data["prices"] = sorted(compacted, key=lambda e: e["date"]) + recent
+    
+    return history
+
+def normalize_search_text(text):
+    """Normalize a product name or query for search (mirrored by normalizeText() in the dashboard)"""
+    text = "".join(SEARCH_CHAR_MAP.get(ch, ch) for ch in text.lower())
+    return " ".join(text.split())
+
+def build_search_index(products, n=3):
+    """Build an n-gram index and presorted orderings for the price history dashboard"""
+    names = [normalize_search_text(p["name"]) for p in products]
+    grams = {}
+    for idx, name in enumerate(names):
+        for gram in {name[i:i + n] for i in range(len(name) - n + 1)}:
+            grams.setdefault(gram, []).append(idx)
+    
+    indices = range(len(products))
+    return {
+        "n": n,
+        "charMap": SEARCH_CHAR_MAP,
+        "names": names,
+        "grams": grams,
+        # The name order needs Persian collation, so the dashboard builds it with Intl.Collator
+        "order": {
+            "priceAsc": sorted(indices, key=lambda i: products[i]["latest_lowest"]),
+            "changeDesc": sorted(indices, key=lambda i: -abs(products[i]["price_change"]))
+        }
+    }
+
+# Collects product cards not harvested yet, so each call only returns compact records
+# for cards that appeared since the previous scroll step. Cards are only marked once
+# their name and price have rendered; incomplete ones are returned again next time.
+HARVEST_CARDS_JS = """
+var cards = [];
+document.querySelectorAll("a[href*='/p/']:not([data-harvested])").forEach(function(a) {
+  var name = a.querySelector("h2[class*='ProductCard_desktop_product-name']");
+  var price = a.querySelector("div[class*='ProductCard_desktop_product-price-text']");
+  if (name && price) a.setAttribute('data-harvested', '1');
+  cards.push({
+    href: a.getAttribute('href') || '',
+    name: name ? name.textContent.trim() : 'N/A',
+    price: price ? price.textContent.trim() : 'N/A'
+  });
+});
+return cards;
+"""
+
+def harvest_cards(driver, cards):
+    """Add newly rendered product cards to `cards` (keyed by product ID), return how many were new"""
+    new_count = 0
+    for card in driver.execute_script(HARVEST_CARDS_JS):
+        link = "https://torob.com" + card["href"]
+        pid = product_id(link)
+        if pid not in cards:
+            cards[pid] = {"link": link, "name": card["name"], "price": card["price"]}
+            new_count += 1
+        else:
+            # Fill in a name or price that had not rendered when the card was first seen
+            for field in ("name", "price"):
+                if cards[pid][field] == "N/A" and card[field] != "N/A":
+                    cards[pid][field] = card[field]
+    return new_count
+
+def scroll_and_harvest(driver, pause_time=2):
+    """Scroll step by step, harvesting product cards as they render, until no new cards appear"""
+    cards = {}
+    harvest_cards(driver, cards)
     
     while True:
         # Scroll down in smaller increments
         driver.execute_script("window.scrollBy(0, 800);")
         time.sleep(pause_time)
         
-        # Calculate new scroll height
-        new_height = driver.execute_script("return document.body.scrollHeight")
+        if harvest_cards(driver, cards):
+            continue
         
-        # Check if we've reached the bottom
-        current_position = driver.execute_script("return window.pageYOffset + window.innerHeight")
+        # Keep scrolling through cards that were already rendered and harvested
+        at_bottom = driver.execute_script(
+            "return window.pageYOffset + window.innerHeight >= document.body.scrollHeight"
+        )
+        if not at_bottom:
+            continue
         
-        if current_position >= new_height:
-            # Try one more time to see if more content loads
-            time.sleep(3)
-            final_height = driver.execute_script("return document.body.scrollHeight")
-            if final_height == new_height:
-                break
-            new_height = final_height
-        
-        last_height = new_height
+        # Nothing new at the bottom - give lazy loading one more chance before stopping
+        time.sleep(3)
+        if not harvest_cards(driver, cards):
+            break
+    
+    return cards
 
 # --- Selenium setup ---
-options = Options()
-options.add_argument("--headless")
-options.add_argument("--disable-gpu")
-options.add_argument("--no-sandbox")
-options.add_argument("--window-size=1920,1080")
-options.add_argument("--disable-blink-features=AutomationControlled")
-options.add_experimental_option("excludeSwitches", ["enable-automation"])
-options.add_experimental_option('useAutomationExtension', False)
-
-driver = webdriver.Chrome(options=options)
-
-url = "https://torob.com/shop/58933/%D8%AA%D8%AC%D9%87%DB%8C%D8%B2%D8%A7%D8%AA-%D8%AA%D9%88%D8%A7%D9%86%D8%A8%D8%AE%D8%B4%DB%8C-%DA%A9%D9%88%D8%B4%D8%A7/%D9%85%D8%AD%D8%B5%D9%88%D9%84%D8%A7%D8%AA/"
-print("🌐 Loading page...")
-driver.get(url)
-
-# Wait for initial content to load
-time.sleep(5)
-
-print("📜 Scrolling to load all products...")
-smooth_scroll(driver, pause_time=2)
-
-soup = BeautifulSoup(driver.page_source, "html.parser")
-product_links = soup.select("a[href*='/p/']")
-
-# Remove duplicates
-unique_links = {}
-for a in product_links:
-    link = "https://torob.com" + a.get("href", "")
-    if link not in unique_links:
-        unique_links[link] = a
-
-print(f"✅ Found {len(unique_links)} unique products")
-
-# Load existing price history
-history = load_history()
-products = []
-
-for idx, (link, a) in enumerate(unique_links.items(), 1):
-    print(f"Processing {idx}/{len(unique_links)}: {link}")
-    
-    name_tag = a.select_one("h2[class*='ProductCard_desktop_product-name']")
-    name = name_tag.get_text(strip=True) if name_tag else "N/A"
-    price_tag = a.select_one("div[class*='ProductCard_desktop_product-price-text']")
-    current_price_text = price_tag.get_text(strip=True) if price_tag else "N/A"
-    current_price_num = extract_number(current_price_text) if current_price_text != "N/A" else None
+PAGE_LOAD_TIMEOUT = 60
 
-    # Fetch lowest price from product page
-    try:
-        driver.get(link)
-        time.sleep(3)
-        inner_soup = BeautifulSoup(driver.page_source, "html.parser")
+SHOP_URL = "https://torob.com/shop/58933/%D8%AA%D8%AC%D9%87%DB%8C%D8%B2%D8%A7%D8%AA-%D8%AA%D9%88%D8%A7%D9%86%D8%A8%D8%AE%D8%B4%DB%8C-%DA%A9%D9%88%D8%B4%D8%A7/%D9%85%D8%AD%D8%B5%D9%88%D9%84%D8%A7%D8%AA/"
+
+def create_driver():
+    """Start a headless Chrome instance"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option('useAutomationExtension', False)
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    return driver
 
-        price_elems = inner_soup.select("a.price.seller-element")
-        all_prices = []
+def collect_shop_products(driver):
+    """Load the shop listing and harvest its product cards, keyed by product ID"""
+    print("🌐 Loading page...")
+    driver.get(SHOP_URL)
+    
+    # Wait for initial content to load
+    time.sleep(5)
+    
+    print("📜 Scrolling and collecting products...")
+    # Product cards are keyed by product ID, so the same product under different slugs or query strings is visited once
+    unique_links = scroll_and_harvest(driver, pause_time=2)
+    
+    print(f"✅ Found {len(unique_links)} unique products")
+    return unique_links
 
-        for p in price_elems:
-            txt = p.get_text(strip=True)
-            num = extract_number(txt)
-            if num:
-                all_prices.append(num)
+# Product pages are parsed in worker processes while the browser loads the next page;
+# at most PARSE_BACKLOG pages wait for parsing before navigation pauses
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_BACKLOG = PARSE_WORKERS * 2
 
-        lowest_price_num = min(all_prices) if all_prices else current_price_num
-        lowest_price = f"{lowest_price_num:,} تومان" if lowest_price_num else "N/A"
-        
-        # Update price history with both prices
-        if lowest_price_num and current_price_num:
-            history = update_price_history(history, name, link, lowest_price_num, current_price_num)
+def fetch_product_page(driver, link):
+    """Load a product page and return its HTML"""
+    driver.get(link)
+    time.sleep(3)
+    return driver.page_source
+
+def parse_lowest_seller_price(html):
+    """Extract the lowest seller price from product page HTML (runs in a parser process)"""
+    from bs4 import BeautifulSoup
+    
+    inner_soup = BeautifulSoup(html, "html.parser")
+    
+    price_elems = inner_soup.select("a.price.seller-element")
+    all_prices = []
+    
+    for p in price_elems:
+        txt = p.get_text(strip=True)
+        num = extract_number(txt)
+        if num:
+            all_prices.append(num)
+    
+    return min(all_prices) if all_prices else None
+
+def make_observation(pid, card, lowest_seller_price, observed_at):
+    """Combine a product card with the lowest seller price found on its page"""
+    current_price_text = card["price"] or "N/A"
+    current_price_num = extract_number(current_price_text) if current_price_text != "N/A" else None
+    
+    return {
+        "pid": pid,
+        "link": card["link"],
+        "name": card["name"] or "N/A",
+        "price": current_price_text,
+        "lowest_price": lowest_seller_price or current_price_num,
+        "current_price": current_price_num,
+        "date": observed_at.strftime("%Y-%m-%d"),
+        "observed_at": observed_at.isoformat()
+    }
+
+class ParserPool:
+    """Process pool for page parsing that is replaced when a parser process dies"""
+    
+    def __init__(self, max_workers=PARSE_WORKERS):
+        self.max_workers = max_workers
+        self.generation = 0
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.shutdown()
+    
+    def submit(self, html):
+        """Queue a page for parsing, return its future and the pool generation it runs in"""
+        try:
+            future = self.executor.submit(parse_lowest_seller_price, html)
+        except BrokenProcessPool:
+            self.replace(self.generation)
+            future = self.executor.submit(parse_lowest_seller_price, html)
+        return future, self.generation
+    
+    def replace(self, generation):
+        """Start a fresh pool, unless the broken one was already replaced"""
+        if generation != self.generation:
+            return
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.generation += 1
+    
+    def shutdown(self):
+        self.executor.shutdown()
+
+def observe_products(driver, items, pool, log_prefix=""):
+    """Visit product pages in order, parsing them in `pool` while the driver moves on.
+    
+    Yields (pid, card, observation, error) in the order of `items`; exactly one of
+    observation and error is set.
+    """
+    pending = deque()
+    
+    def collect():
+        pid, card, observed_at, html, result = pending.popleft()
+        try:
+            if isinstance(result, Exception):
+                raise result
+            future, generation = result
+            try:
+                lowest_seller_price = future.result()
+            except BrokenProcessPool:
+                # A parser process died (e.g. out of memory) and took every job in the pool
+                # with it; parse this page again in a fresh pool. Only a page that breaks
+                # the fresh pool too is reported as an error.
+                pool.replace(generation)
+                future, generation = pool.submit(html)
+                lowest_seller_price = future.result()
+            return pid, card, make_observation(pid, card, lowest_seller_price, observed_at), None
+        except Exception as e:
+            return pid, card, None, e
+    
+    for idx, (pid, card) in enumerate(items, 1):
+        print(f"{log_prefix}Processing {idx}/{len(items)}: {card['link']}")
+        try:
+            observed_at = datetime.now()
+            html = fetch_product_page(driver, card["link"])
+            pending.append((pid, card, observed_at, html, pool.submit(html)))
+        except Exception as e:
+            pending.append((pid, card, None, None, e))
         
-        # Get price history for this product
-        price_history = history.get(link, {}).get("prices", [])
+        # Backpressure: don't keep more than PARSE_BACKLOG pages of HTML in flight
+        while len(pending) >= PARSE_BACKLOG:
+            yield collect()
+    
+    while pending:
+        yield collect()
 
-        products.append({
-            "name": name,
-            "price": current_price_text,
-            "lowest_price": lowest_price,
-            "link": link,
-            "price_history": price_history
-        })
-    except Exception as e:
-        print(f"  ⚠️ Error processing product: {e}")
-        continue
+def apply_observation(history, observation):
+    """Record an observation's lowest and current price in the history"""
+    if observation["lowest_price"] and observation["current_price"]:
+        history = update_price_history(
+            history, observation["name"], observation["link"],
+            observation["lowest_price"], observation["current_price"], observation["date"],
+            observation["observed_at"], observation.get("worker")
+        )
+    return history
 
-driver.quit()
+def product_row(observation, history):
+    """Build the index.html entry for an observed product"""
+    lowest_price_num = observation["lowest_price"]
+    return {
+        "name": observation["name"],
+        "price": observation["price"],
+        "lowest_price": f"{lowest_price_num:,} تومان" if lowest_price_num else "N/A",
+        "link": observation["link"],
+        "price_history": history.get(observation["pid"], {}).get("prices", [])
+    }
+
+def crawl():
+    """Crawl the shop on this machine and update history and reports directly"""
+    driver = create_driver()
+    unique_links = collect_shop_products(driver)
+    observations = []
+    
+    with ParserPool() as pool:
+        for pid, card, observation, error in observe_products(driver, list(unique_links.items()), pool):
+            if error:
+                print(f"  ⚠️ Error processing product {card['link']}: {error}")
+                continue
+            observations.append(observation)
+    
+    driver.quit()
+    
+    # Load, update and save the history in one locked step, so concurrent merges or compactions aren't lost
+    with history_lock():
+        history = load_history()
+        history, products = merge_observations(history, observations)
+        save_history(history)
+    print(f"💾 Price history saved!")
+    
+    generate_reports(products, history)
 
-# Save updated history
-save_history(history)
-print(f"💾 Price history saved!")
+def compact(daily_days=90, weekly_days=365):
+    """Downsample old entries of the saved price history"""
+    with history_lock():
+        history = load_history()
+        before = sum(len(data["prices"]) for data in history.values())
+        history = compact_history(history, daily_days, weekly_days)
+        after = sum(len(data["prices"]) for data in history.values())
+        save_history(history)
+    print(f"🗜️ Compacted price history: {before} -> {after} entries")
 
 # --- Generate HTML with price charts ---
 template_html = """
@@ -376,15 +695,6 @@ function toggleChart(chartId, button) {
 </html>
 """
 
-template = Template(template_html)
-output = template.render(
-    products=products,
-    update_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-)
-
-with open("index.html", "w", encoding="utf-8") as f:
-    f.write(output)
-
 # --- Generate Price History Dashboard ---
 history_template = """
 <!DOCTYPE html>
@@ -584,7 +894,7 @@ body {
 
 <div class="container" id="productsContainer">
 {% for p in products_with_history %}
-<div class="product-card" data-name="{{ p.name|lower }}" data-price="{{ p.latest_lowest }}" data-change="{{ p.price_change }}">
+<div class="product-card">
   <div class="product-name">{{ p.name }}</div>
   
   <div class="price-info">
@@ -711,74 +1021,345 @@ body {
 </div>
 
 <script>
+// Built by build_search_index(): normalized names, n-gram postings and presorted card orders
+var SEARCH_INDEX = {{ search_index|tojson }};
+var cards = Array.from(document.querySelectorAll('.product-card'));
+var visible = cards.map(function() { return true; });
+
+// Name order uses Persian collation (پ, چ, ژ, ک, گ in alphabet position), computed once at load
+var nameCollator = new Intl.Collator('fa');
+SEARCH_INDEX.order.name = SEARCH_INDEX.names.map(function(_, i) { return i; }).sort(function(a, b) {
+  return nameCollator.compare(SEARCH_INDEX.names[a], SEARCH_INDEX.names[b]);
+});
+
+function normalizeText(text) {
+  var chars = Array.from(text.toLowerCase(), function(ch) {
+    return SEARCH_INDEX.charMap[ch] || ch;
+  });
+  return chars.join('').replace(/\\s+/g, ' ').trim();
+}
+
+function searchIndex(query) {
+  var n = SEARCH_INDEX.n;
+  var names = SEARCH_INDEX.names;
+  var candidates;
+  
+  if (query.length < n) {
+    candidates = names.map(function(_, i) { return i; });
+  } else {
+    // Start from the rarest n-gram of the query, then verify each candidate
+    for (var i = 0; i + n <= query.length; i++) {
+      var postings = SEARCH_INDEX.grams[query.substr(i, n)];
+      if (!postings) return [];
+      if (!candidates || postings.length < candidates.length) candidates = postings;
+    }
+  }
+  return candidates.filter(function(idx) { return names[idx].includes(query); });
+}
+
 function filterProducts() {
-  const searchValue = document.getElementById('searchInput').value.toLowerCase();
-  const cards = document.querySelectorAll('.product-card');
+  var query = normalizeText(document.getElementById('searchInput').value);
+  var matches = new Uint8Array(cards.length);
+  
+  if (query) {
+    searchIndex(query).forEach(function(idx) { matches[idx] = 1; });
+  } else {
+    matches.fill(1);
+  }
   
-  cards.forEach(card => {
-    const name = card.getAttribute('data-name');
-    if (name.includes(searchValue)) {
-      card.style.display = 'block';
-    } else {
-      card.style.display = 'none';
+  cards.forEach(function(card, idx) {
+    var show = matches[idx] === 1;
+    if (show !== visible[idx]) {
+      card.style.display = show ? 'block' : 'none';
+      visible[idx] = show;
     }
   });
 }
 
 function sortProducts() {
-  const sortValue = document.getElementById('sortSelect').value;
-  const container = document.getElementById('productsContainer');
-  const cards = Array.from(container.querySelectorAll('.product-card'));
+  var sortValue = document.getElementById('sortSelect').value;
+  var container = document.getElementById('productsContainer');
+  var order;
   
-  cards.sort((a, b) => {
-    switch(sortValue) {
-      case 'name':
-        return a.getAttribute('data-name').localeCompare(b.getAttribute('data-name'));
-      case 'priceAsc':
-        return parseFloat(a.getAttribute('data-price')) - parseFloat(b.getAttribute('data-price'));
-      case 'priceDesc':
-        return parseFloat(b.getAttribute('data-price')) - parseFloat(a.getAttribute('data-price'));
-      case 'changeDesc':
-        return Math.abs(parseFloat(b.getAttribute('data-change'))) - Math.abs(parseFloat(a.getAttribute('data-change')));
-      default:
-        return 0;
-    }
-  });
+  if (sortValue === 'priceDesc') {
+    order = SEARCH_INDEX.order.priceAsc.slice().reverse();
+  } else {
+    order = SEARCH_INDEX.order[sortValue];
+  }
+  if (!order) return;
   
-  cards.forEach(card => container.appendChild(card));
+  var fragment = document.createDocumentFragment();
+  order.forEach(function(idx) { fragment.appendChild(cards[idx]); });
+  container.appendChild(fragment);
 }
 </script>
 </body>
 </html>
 """
 
-# Prepare data for history dashboard
-products_with_history = []
-for link, data in history.items():
-    if len(data.get("prices", [])) > 1:
-        prices = data["prices"]
-        first_price = prices[0]["lowest_price"]
-        latest_price = prices[-1]["lowest_price"]
-        price_change = ((latest_price - first_price) / first_price) * 100 if first_price > 0 else 0
+def generate_reports(products, history):
+    """Render index.html for this run's products and price_history.html for the whole history"""
+    from jinja2 import Template
+    
+    template = Template(template_html)
+    output = template.render(
+        products=products,
+        update_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
+    
+    with open("index.html", "w", encoding="utf-8") as f:
+        f.write(output)
+    
+    # Prepare data for history dashboard
+    products_with_history = []
+    for pid, data in history.items():
+        if len(data.get("prices", [])) > 1:
+            prices = data["prices"]
+            first_price = prices[0]["lowest_price"]
+            latest_price = prices[-1]["lowest_price"]
+            price_change = ((latest_price - first_price) / first_price) * 100 if first_price > 0 else 0
+            
+            products_with_history.append({
+                "name": data["name"],
+                "link": data.get("link", pid),
+                "price_history": prices,
+                "latest_lowest": prices[-1]["lowest_price"],
+                "latest_current": prices[-1]["current_price"],
+                "price_change": price_change
+            })
+    
+    history_template_obj = Template(history_template)
+    history_output = history_template_obj.render(
+        products_with_history=products_with_history,
+        search_index=build_search_index(products_with_history),
+        update_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
+    
+    with open("price_history.html", "w", encoding="utf-8") as f:
+        f.write(history_output)
+    
+    print(f"✅ Done! Saved {len(products)} products to index.html")
+    print(f"📊 Price history dashboard saved to price_history.html")
+    print(f"📈 Tracking {len(products_with_history)} products with price history")
+
+# --- Distributed crawling ---
+# Workers lease product links from a shared queue (SQLite here), write their
+# observations to their own shard files and never touch price_history.json.
+# A single merge step then folds all shards into the history deterministically.
+QUEUE_DB = "crawl_queue.db"
+SHARD_DIR = "history_shards"
+MAX_ATTEMPTS = 3
+# Upper bound on the time one product takes (page load timeout, settle time, parsing),
+# used to size leases so a batch never outlives its lease
+PAGE_TIME_BOUND = PAGE_LOAD_TIMEOUT + 15
+
+def open_queue(path=QUEUE_DB):
+    """Open the work queue, creating its table if needed"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS links (
+            pid TEXT PRIMARY KEY,
+            position INTEGER,
+            link TEXT,
+            name TEXT,
+            price TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires REAL
+        )
+    """)
+    return conn
+
+def enqueue_links(conn, cards):
+    """Queue harvested product cards for crawling, resetting products queued by earlier runs"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    # Links currently leased by a worker are left alone
+    conn.executemany("""
+        INSERT INTO links (pid, position, link, name, price) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(pid) DO UPDATE SET
+            position = excluded.position, link = excluded.link, name = excluded.name, price = excluded.price,
+            status = 'pending', attempts = 0, lease_owner = NULL, lease_expires = NULL
+        WHERE links.lease_owner IS NULL OR links.lease_expires < ?
+    """, [(pid, idx, card["link"], card["name"], card["price"], now) for idx, (pid, card) in enumerate(cards.items())])
+    conn.execute("COMMIT")
+
+def lease_links(conn, worker_id, batch_size=5):
+    """Lease up to `batch_size` pending links (including ones whose lease expired) to a worker"""
+    now = time.time()
+    lease_seconds = batch_size * PAGE_TIME_BOUND
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute("""
+            SELECT pid, link, name, price FROM links
+            WHERE status = 'pending' AND (lease_expires IS NULL OR lease_expires < ?)
+            ORDER BY position LIMIT ?
+        """, (now, batch_size)).fetchall()
+        conn.executemany(
+            "UPDATE links SET lease_owner = ?, lease_expires = ? WHERE pid = ?",
+            [(worker_id, now + lease_seconds, row[0]) for row in rows]
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return [(pid, {"link": link, "name": name, "price": price}) for pid, link, name, price in rows]
+
+def renew_leases(conn, worker_id, batch_size):
+    """Extend the leases a worker still holds, as it makes progress through its batch"""
+    conn.execute(
+        "UPDATE links SET lease_expires = ? WHERE lease_owner = ? AND status = 'pending'",
+        (time.time() + batch_size * PAGE_TIME_BOUND, worker_id)
+    )
+
+def complete_link(conn, pid, worker_id):
+    """Mark a crawled link as done, unless its lease has passed to another worker"""
+    conn.execute(
+        "UPDATE links SET status = 'done', lease_owner = NULL, lease_expires = NULL WHERE pid = ? AND lease_owner = ?",
+        (pid, worker_id)
+    )
+
+def fail_link(conn, pid, worker_id):
+    """Release a link that could not be crawled, giving up after MAX_ATTEMPTS"""
+    conn.execute("""
+        UPDATE links SET
+            attempts = attempts + 1,
+            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+            lease_owner = NULL, lease_expires = NULL
+        WHERE pid = ? AND lease_owner = ?
+    """, (MAX_ATTEMPTS, pid, worker_id))
+
+def pending_count(conn):
+    """Number of links still waiting to be crawled (leased or not)"""
+    return conn.execute("SELECT COUNT(*) FROM links WHERE status = 'pending'").fetchone()[0]
+
+def write_shard(worker_id, observations):
+    """Write a batch of observations to a new shard file owned by this worker"""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    path = os.path.join(SHARD_DIR, f"{worker_id}-{time.time_ns()}.json")
+    # Shards only become visible to the merge step once completely written
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(observations, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def load_shards():
+    """Return the shard paths ready for merging and all observations they contain"""
+    paths = sorted(glob.glob(os.path.join(SHARD_DIR, "*.json")))
+    observations = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            observations.extend(json.load(f))
+    return paths, observations
+
+def merge_observations(history, observations):
+    """Apply observations in a deterministic order, the latest one per product and day winning"""
+    latest = {}
+    for observation in sorted(observations, key=lambda o: observation_order(o) + (o["pid"],)):
+        history = apply_observation(history, observation)
+        latest[observation["pid"]] = observation
+    products = [product_row(observation, history) for observation in latest.values()]
+    return history, products
+
+def enqueue():
+    """Harvest the shop listing and fill the work queue"""
+    driver = create_driver()
+    try:
+        cards = collect_shop_products(driver)
+    finally:
+        driver.quit()
+    conn = open_queue()
+    enqueue_links(conn, cards)
+    conn.close()
+    print(f"📥 Queued {len(cards)} products in {QUEUE_DB}")
+
+def run_worker(worker_id=None, batch_size=20):
+    """Crawl leased links until the queue is drained, writing observations to shards"""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    conn = open_queue()
+    driver = create_driver()
+    pool = ParserPool()
+    
+    try:
+        while True:
+            batch = lease_links(conn, worker_id, batch_size)
+            if not batch:
+                if not pending_count(conn):
+                    break
+                # Other workers still hold leases; wait for them to finish or expire
+                time.sleep(10)
+                continue
+            
+            observations = []
+            for pid, card, observation, error in observe_products(driver, batch, pool, f"[{worker_id}] "):
+                renew_leases(conn, worker_id, batch_size)
+                if error:
+                    print(f"  ⚠️ Error processing product {card['link']}: {error}")
+                    fail_link(conn, pid, worker_id)
+                    continue
+                observation["worker"] = worker_id
+                observations.append(observation)
+            
+            # Persist the shard before completing its links, so a crash only causes a re-crawl
+            if observations:
+                write_shard(worker_id, observations)
+            for observation in observations:
+                complete_link(conn, observation["pid"], worker_id)
+    finally:
+        pool.shutdown()
+        driver.quit()
+        conn.close()
+    
+    print(f"✅ Worker {worker_id} finished")
+
+def merge():
+    """Fold all worker shards into price_history.json and regenerate the reports"""
+    # Shards are read and removed under the history lock, so concurrent merges can't drop each other's work
+    with history_lock():
+        paths, observations = load_shards()
+        if not paths:
+            print("🤷 No shards to merge")
+            return
         
-        products_with_history.append({
-            "name": data["name"],
-            "link": link,
-            "price_history": prices,
-            "latest_lowest": prices[-1]["lowest_price"],
-            "latest_current": prices[-1]["current_price"],
-            "price_change": price_change
-        })
-
-history_template_obj = Template(history_template)
-history_output = history_template_obj.render(
-    products_with_history=products_with_history,
-    update_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-)
-
-with open("price_history.html", "w", encoding="utf-8") as f:
-    f.write(history_output)
-
-print(f"✅ Done! Saved {len(products)} products to index.html")
-print(f"📊 Price history dashboard saved to price_history.html")
-print(f"📈 Tracking {len(products_with_history)} products with price history")
+        history = load_history()
+        history, products = merge_observations(history, observations)
+        save_history(history)
+        # Only drop shards once the merged history is safely on disk
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    print(f"🔀 Merged {len(observations)} observations from {len(paths)} shards")
+    
+    generate_reports(products, history)
+
+USAGE = """Usage:
+  python main.py                                    crawl the shop on this machine
+  python main.py compact [daily_days] [weekly_days] downsample old price history
+  python main.py enqueue                            queue the shop's products for workers
+  python main.py worker [worker_id]                 crawl queued products into a shard
+  python main.py merge                              merge worker shards into the history
+"""
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "crawl"
+    
+    if command == "crawl":
+        crawl()
+    elif command == "compact":
+        daily_days = int(sys.argv[2]) if len(sys.argv) > 2 else 90
+        weekly_days = int(sys.argv[3]) if len(sys.argv) > 3 else 365
+        compact(daily_days, weekly_days)
+    elif command == "enqueue":
+        enqueue()
+    elif command == "worker":
+        run_worker(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == "merge":
+        merge()
+    else:
+        print(USAGE)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
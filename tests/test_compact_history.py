@@ -0,0 +1,56 @@
+import copy
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from main import compact_history
+
+
+def make_prices(last_day, days):
+    rng = random.Random(days)
+    return [
+        {
+            "date": (last_day - timedelta(days=d)).strftime("%Y-%m-%d"),
+            "lowest_price": rng.randint(1, 999),
+            "current_price": rng.randint(1, 999),
+        }
+        for d in range(days, -1, -1)
+    ]
+
+
+@pytest.mark.parametrize("first_day, gap", [(date(2026, 1, 1), 200), (date(2026, 3, 17), 45), (date(2026, 6, 30), 1)])
+def test_incremental_compaction_matches_single_compaction(first_day, gap):
+    second_day = first_day + timedelta(days=gap)
+    prices = make_prices(second_day, 800)
+    cutoff = first_day.strftime("%Y-%m-%d")
+
+    incremental = {"p": {"name": "n", "link": "l", "prices": [e for e in copy.deepcopy(prices) if e["date"] <= cutoff]}}
+    compact_history(incremental, today=first_day)
+    incremental["p"]["prices"] += [e for e in copy.deepcopy(prices) if e["date"] > cutoff]
+    compact_history(incremental, today=second_day)
+
+    once = {"p": {"name": "n", "link": "l", "prices": copy.deepcopy(prices)}}
+    compact_history(once, today=second_day)
+
+    assert incremental == once
+
+
+def test_weekly_aggregates_do_not_span_months():
+    today = date(2026, 10, 19)
+    prices = make_prices(today, 400)
+    history = {"p": {"name": "n", "link": "l", "prices": copy.deepcopy(prices)}}
+    compact_history(history, today=today)
+
+    for entry in history["p"]["prices"]:
+        if entry.get("period") != "week":
+            continue
+        day = date.fromisoformat(entry["date"])
+        members = [
+            e for e in prices
+            if e["date"][:7] == entry["date"][:7]
+            and date.fromisoformat(e["date"]).isocalendar()[:2] == day.isocalendar()[:2]
+        ]
+        assert entry["lowest_price_min"] == min(e["lowest_price"] for e in members)
+        assert entry["lowest_price_max"] == max(e["lowest_price"] for e in members)
+        assert entry["date"] == members[-1]["date"]
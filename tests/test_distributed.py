@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+import main
+from main import (
+    complete_link,
+    enqueue_links,
+    fail_link,
+    lease_links,
+    merge_observations,
+    open_queue,
+    pending_count,
+)
+
+PID = "f03975a7-2e0f-412d-b72e-1c484152b2e7"
+
+
+def observation(observed_at, lowest_price, worker="w1"):
+    return {
+        "pid": PID,
+        "link": f"https://torob.com/p/{PID}/slug/",
+        "name": "product",
+        "price": "1,000,000",
+        "lowest_price": lowest_price,
+        "current_price": 1000000,
+        "date": observed_at[:10],
+        "observed_at": observed_at,
+        "worker": worker,
+    }
+
+
+def test_later_observation_wins_in_one_merge():
+    history, _ = merge_observations({}, [observation("2026-10-19T15:00:00", 100), observation("2026-10-19T09:00:00", 200)])
+    assert history[PID]["prices"][-1]["lowest_price"] == 100
+
+
+def test_merging_in_separate_runs_matches_one_merge():
+    early, late = observation("2026-10-19T09:00:00", 200), observation("2026-10-19T15:00:00", 100)
+    once, _ = merge_observations({}, [early, late])
+
+    # A slow worker's older shard shows up after the newer one was merged
+    split, _ = merge_observations({}, [late])
+    split, _ = merge_observations(split, [early])
+
+    assert split == once
+    assert split[PID]["prices"][-1]["lowest_price"] == 100
+
+
+def test_observation_replaces_legacy_entry_without_observed_at():
+    history = {PID: {"name": "product", "link": "l", "prices": [{"date": "2026-10-19", "lowest_price": 5, "current_price": 5}]}}
+    history, _ = merge_observations(history, [observation("2026-10-19T09:00:00", 200)])
+    assert history[PID]["prices"] == [
+        {"date": "2026-10-19", "lowest_price": 200, "current_price": 1000000, "observed_at": "2026-10-19T09:00:00", "worker": "w1"}
+    ]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(main.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path):
+    conn = open_queue(str(tmp_path / "queue.db"))
+    cards = {f"id{i}": {"link": f"https://torob.com/p/id{i}/", "name": f"n{i}", "price": "1"} for i in range(4)}
+    enqueue_links(conn, cards)
+    yield conn, cards
+    conn.close()
+
+
+def rows(conn):
+    return {pid: (status, attempts, owner) for pid, status, attempts, owner in conn.execute(
+        "SELECT pid, status, attempts, lease_owner FROM links"
+    )}
+
+
+def test_leases_are_exclusive_until_they_expire(queue, clock):
+    conn, _ = queue
+    assert [pid for pid, _ in lease_links(conn, "A", 2)] == ["id0", "id1"]
+    assert [pid for pid, _ in lease_links(conn, "B", 4)] == ["id2", "id3"]
+    assert lease_links(conn, "C", 4) == []
+
+    clock[0] += 2 * main.PAGE_TIME_BOUND + 1
+    assert [pid for pid, _ in lease_links(conn, "C", 2)] == ["id0", "id1"]
+    assert rows(conn)["id0"][2] == "C"
+
+
+def test_stale_worker_cannot_complete_or_fail_a_released_link(queue, clock):
+    conn, _ = queue
+    lease_links(conn, "A", 2)
+    clock[0] += 2 * main.PAGE_TIME_BOUND + 1
+    lease_links(conn, "B", 2)
+
+    complete_link(conn, "id0", "A")
+    fail_link(conn, "id1", "A")
+    assert rows(conn)["id0"] == ("pending", 0, "B")
+    assert rows(conn)["id1"] == ("pending", 0, "B")
+
+    complete_link(conn, "id0", "B")
+    fail_link(conn, "id1", "B")
+    assert rows(conn)["id0"] == ("done", 0, None)
+    assert rows(conn)["id1"] == ("pending", 1, None)
+
+
+def test_links_fail_after_max_attempts(queue):
+    conn, _ = queue
+    for _ in range(main.MAX_ATTEMPTS):
+        lease_links(conn, "A", 1)
+        fail_link(conn, "id0", "A")
+    assert rows(conn)["id0"] == ("failed", main.MAX_ATTEMPTS, None)
+    assert pending_count(conn) == 3
+
+
+def test_reenqueue_leaves_leased_links_alone(queue, clock):
+    conn, cards = queue
+    lease_links(conn, "A", 1)
+    complete_link(conn, "id0", "A")
+    lease_links(conn, "A", 1)
+
+    enqueue_links(conn, cards)
+    state = rows(conn)
+    assert state["id0"] == ("pending", 0, None)
+    assert state["id1"] == ("pending", 0, "A")
+
+    clock[0] += main.PAGE_TIME_BOUND + 1
+    enqueue_links(conn, cards)
+    assert rows(conn)["id1"] == ("pending", 0, None)
@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import main
+from main import ParserPool, observe_products
+
+pytestmark = pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="parser patches only reach pool processes that are forked",
+)
+
+
+def crashing_parse(html):
+    # "crash-*" pages kill their parser the first time only, "poison" every time
+    marker = html.split("|")[1]
+    if html.startswith("poison") or (html.startswith("crash") and not os.path.exists(marker)):
+        open(marker, "w").close()
+        os._exit(1)
+    return int(html.split("|")[0].split("-")[-1])
+
+
+class FakeDriver:
+    pass
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    marker = str(tmp_path / "crashed")
+    monkeypatch.setattr(main, "parse_lowest_seller_price", crashing_parse)
+    monkeypatch.setattr(main, "fetch_product_page", lambda driver, link: f"{link}|{marker}")
+    monkeypatch.setattr(main, "PARSE_BACKLOG", 3)
+
+
+def run(links):
+    items = [(link, {"link": link, "name": "n", "price": "1"}) for link in links]
+    with ParserPool(max_workers=2) as pool:
+        return list(observe_products(FakeDriver(), items, pool))
+
+
+def test_pool_recovers_after_a_parser_process_dies(pipeline):
+    links = ["page-1", "page-2", "crash-3", "page-4", "page-5", "page-6", "page-7"]
+    results = run(links)
+
+    assert [pid for pid, _, _, _ in results] == links
+    assert [error for _, _, _, error in results] == [None] * len(links)
+    assert [obs["lowest_price"] for _, _, obs, _ in results] == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_only_a_page_that_breaks_a_fresh_pool_fails(pipeline):
+    links = ["page-1", "poison", "page-3", "page-4", "page-5"]
+    results = run(links)
+
+    errors = {pid: error for pid, _, _, error in results if error}
+    assert list(errors) == ["poison"]
+    assert isinstance(errors["poison"], BrokenProcessPool)